@@ -1,9 +1,17 @@
 import streamlit as st
-import requests
+import asyncio
+import httpx
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import json
 import re
 from collections import Counter
+from contextlib import closing
+import os
+import sqlite3
 import time
 from datetime import datetime
 import plotly.express as px
@@ -72,33 +80,85 @@ PREPOSITIONS = ["for", "with", "without", "to", "near", "in", "on", "about", "ve
 COMPARISONS = ["vs", "versus", "alternative", "alternatives", "compare", "comparison", "like", "similar", "better than", "instead of", "rather than"]
 INTENT_MODIFIERS = ["buy", "purchase", "cheap", "best", "review", "price", "cost", "free", "download", "tutorial", "guide", "tips", "how to"]
 TEMPORAL = ["2024", "2025", "latest", "new", "today", "now", "recent", "upcoming", "future", "trends"]
+RELATED_LETTERS = "abcdefghij"  # Limit to first 10 letters for performance
+RELATED_LIMIT = 50
+
+BUCKET_NAMES = ["Questions", "Prepositions", "Comparisons", "Commercial Intent", "Temporal", "Related Searches"]
+
+# (bucket, template) pairs expanded for every seed via template.format(seed=...)
+PATTERNS: tuple[tuple[str, str], ...] = (
+    # Original categories
+    *[("Questions", f"{q} {{seed}}") for q in QUESTION_WORDS],
+    *[("Prepositions", tpl) for p in PREPOSITIONS for tpl in (f"{{seed}} {p}", f"{p} {{seed}}")],
+    *[("Comparisons", f"{{seed}} {c}") for c in COMPARISONS],
+    # New categories
+    *[("Commercial Intent", tpl) for intent in INTENT_MODIFIERS for tpl in (f"{intent} {{seed}}", f"{{seed}} {intent}")],
+    *[("Temporal", f"{{seed}} {temporal}") for temporal in TEMPORAL],
+    # Related searches (alphabet soup method)
+    *[("Related Searches", f"{{seed}} {letter}") for letter in RELATED_LETTERS],
+)
+
+SUGGEST_URL = "https://suggestqueries.google.com/complete/search"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.2  # seconds, doubled on each retry
+MAX_RETRY_AFTER = 10  # seconds, cap on server-requested waits
+MAX_CONCURRENCY = 8  # in-flight requests to Google, tuned to rate limits rather than CPUs
+FETCH_BUDGET = 60  # seconds, overall cap on one Generate click's network time
+
+# Per-(query, gl) suggestion cache, shared across sessions and restarts
+SUGGEST_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".suggest_cache.sqlite3")
+SUGGEST_CACHE_TTL = 24 * 60 * 60  # seconds; suggestions for a query are stable for hours
 
 # ────────────────────────────
 ## 4. Enhanced Helper Functions
 # ────────────────────────────
-@st.cache_data(show_spinner=False, ttl=3600)
-def google_autocomplete(query: str, gl: str) -> list[str]:
-    url = "https://suggestqueries.google.com/complete/search"
-    params = {"client": "firefox", "q": query, "gl": gl, "hl": "en"}
-    try:
-        r = requests.get(url, params=params, timeout=5)
-        r.raise_for_status()
-        suggestions = r.json()[1]
-        return suggestions
-    except Exception:
-        return []
-
-@st.cache_data(show_spinner=False, ttl=3600)
-def get_related_searches(query: str, gl: str) -> list[str]:
-    """Get related searches using alphabet soup method"""
-    related = []
-    alphabet = "abcdefghijklmnopqrstuvwxyz"
-    
-    for letter in alphabet[:10]:  # Limit to first 10 letters for performance
-        suggestions = google_autocomplete(f"{query} {letter}", gl)
-        related.extend(suggestions)
-    
-    return list(set(related))[:50]  # Limit and dedupe
+def retry_delay(r: httpx.Response, attempt: int) -> float:
+    """Honor a Retry-After header (in seconds) if present, else back off exponentially"""
+    retry_after = r.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_AFTER)
+    return RETRY_BACKOFF * 2 ** attempt
+
+async def fetch(client: httpx.AsyncClient, sem: asyncio.Semaphore, query: str, gl: str,
+                breaker: asyncio.Event, deadline: float) -> list[str] | None:
+    """Return the suggestions for a query, or None if the request ultimately failed"""
+    loop = asyncio.get_running_loop()
+    # oe=utf-8 pins the response encoding so the raw bytes can go straight to orjson
+    params = {"client": "firefox", "q": query, "gl": gl, "hl": "en", "oe": "utf-8"}
+    # Hold one slot for the whole retry loop so the first failing queries use up
+    # their retries (and trip the breaker) before the rest of the plan starts
+    async with sem:
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+            # Give up early once Google is throttling or unreachable, or the run is out of time
+            if breaker.is_set() or loop.time() >= deadline:
+                return None
+            try:
+                try:
+                    r = await client.get(SUGGEST_URL, params=params)
+                except httpx.TransportError as e:
+                    # Connect/read timeouts and resets are as transient as a 5xx
+                    if last_attempt:
+                        if isinstance(e, httpx.ConnectError):
+                            # Google is unreachable (offline or blocked): fail the whole run fast
+                            breaker.set()
+                        return None
+                    delay = RETRY_BACKOFF * 2 ** attempt
+                else:
+                    if r.status_code not in RETRY_STATUSES or last_attempt:
+                        if r.status_code == 429:
+                            # Still rate limited after every retry: stop sending new requests
+                            breaker.set()
+                        r.raise_for_status()
+                        return orjson.loads(r.content)[1]
+                    delay = retry_delay(r, attempt)
+            except Exception:
+                return None
+            if loop.time() + delay >= deadline:
+                return None
+            await asyncio.sleep(delay)
+    return None
 
 def analyze_keyword_difficulty(keywords: list[str]) -> dict:
     """Simple keyword difficulty analysis based on length and common words"""
@@ -152,49 +212,98 @@ def extract_search_volume_indicators(keywords: list[str]) -> dict:
     
     return volume_indicators
 
-def expand_keyword(seed: str, gl: str) -> dict[str, list[str]]:
-    buckets = {
-        "Questions": [], 
-        "Prepositions": [], 
-        "Comparisons": [],
-        "Commercial Intent": [],
-        "Temporal": [],
-        "Related Searches": []
-    }
-
-    # Original categories
-    for q in QUESTION_WORDS:
-        buckets["Questions"] += google_autocomplete(f"{q} {seed}", gl)
-
-    for p in PREPOSITIONS:
-        buckets["Prepositions"] += google_autocomplete(f"{seed} {p}", gl)
-        buckets["Prepositions"] += google_autocomplete(f"{p} {seed}", gl)
-
-    for c in COMPARISONS:
-        buckets["Comparisons"] += google_autocomplete(f"{seed} {c}", gl)
-
-    # New categories
-    for intent in INTENT_MODIFIERS:
-        buckets["Commercial Intent"] += google_autocomplete(f"{intent} {seed}", gl)
-        buckets["Commercial Intent"] += google_autocomplete(f"{seed} {intent}", gl)
-
-    for temporal in TEMPORAL:
-        buckets["Temporal"] += google_autocomplete(f"{seed} {temporal}", gl)
-
-    # Related searches
-    buckets["Related Searches"] = get_related_searches(seed, gl)
-
-    # Deduplicate all buckets
-    for key in buckets:
-        seen = set()
-        unique = []
-        for s in buckets[key]:
-            if s and s.lower() not in seen and len(s.strip()) > 0:
-                unique.append(s)
-                seen.add(s.lower())
-        buckets[key] = unique[:100]  # Limit per category
+def plan_queries(seeds: list[str], gl: str) -> dict[tuple[str, str], list[tuple[str, str]]]:
+    """Map each unique (query, gl) to the (seed, bucket) destinations it feeds"""
+    plan = {}
+    queries = [(seed, bucket, template.format(seed=seed)) for seed in seeds for bucket, template in PATTERNS]
+    for seed, bucket, query in queries:
+        # e.g. "vs"/"versus" appear in both Prepositions and Comparisons
+        plan.setdefault((query, gl), []).append((seed, bucket))
+    return plan
+
+def open_suggest_cache() -> sqlite3.Connection:
+    conn = sqlite3.connect(SUGGEST_CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS suggestions "
+        "(query TEXT, gl TEXT, fetched_at REAL, suggestions BLOB, PRIMARY KEY (query, gl))"
+    )
+    return conn
 
-    return buckets
+def load_cached_suggestions(keys: list[tuple[str, str]]) -> dict[tuple[str, str], list[str]]:
+    """Return unexpired cached suggestions for whichever (query, gl) keys have them"""
+    try:
+        with closing(open_suggest_cache()) as conn, conn:
+            # Prune expired rows so the file only ever holds about a day of queries
+            conn.execute("DELETE FROM suggestions WHERE fetched_at < ?", (time.time() - SUGGEST_CACHE_TTL,))
+            hits = {}
+            for key in keys:
+                row = conn.execute("SELECT suggestions FROM suggestions WHERE query = ? AND gl = ?", key).fetchone()
+                if row is not None:
+                    hits[key] = orjson.loads(row[0])
+            return hits
+    except sqlite3.Error:
+        return {}
+
+def save_suggestions(fetched: dict[tuple[str, str], list[str]]) -> None:
+    now = time.time()
+    try:
+        with closing(open_suggest_cache()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO suggestions VALUES (?, ?, ?, ?)",
+                [(query, gl, now, orjson.dumps(suggestions)) for (query, gl), suggestions in fetched.items()],
+            )
+    except sqlite3.Error:
+        pass
+
+async def fetch_all(keys: list[tuple[str, str]]) -> list[list[str] | None]:
+    """Fetch the given (query, gl) keys concurrently over one client"""
+    # Semaphores and events bind to the running loop, so create them per asyncio.run
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    breaker = asyncio.Event()
+    deadline = asyncio.get_running_loop().time() + FETCH_BUDGET
+
+    # HTTP/2 multiplexes the whole plan as streams over a handful of warm connections
+    limits = httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=30)
+    async with httpx.AsyncClient(http2=True, timeout=4.0, limits=limits) as client:
+        return await asyncio.gather(*[fetch(client, sem, query, gl, breaker, deadline) for query, gl in keys])
+
+def expand_seeds(seeds: list[str], gl: str) -> tuple[dict[str, dict[str, list[str]]], int]:
+    """Expand seeds into deduplicated buckets, fetching only queries missing from the cache.
+
+    Returns the buckets and the number of queries that failed. Failed queries
+    are not cached, so the next run re-sends only those.
+    """
+    plan = plan_queries(seeds, gl)
+    results_by_query = load_cached_suggestions(list(plan))
+
+    failed = 0
+    misses = [key for key in plan if key not in results_by_query]
+    if misses:
+        results = asyncio.run(fetch_all(misses))
+        fetched = {key: suggestions for key, suggestions in zip(misses, results) if suggestions is not None}
+        save_suggestions(fetched)
+        results_by_query.update(fetched)
+        failed = len(misses) - len(fetched)
+
+    # Fan out in PATTERNS order so every bucket keeps its own modifier order
+    expanded = {seed: {name: [] for name in BUCKET_NAMES} for seed in seeds}
+    for seed, buckets in expanded.items():
+        for bucket, template in PATTERNS:
+            buckets[bucket] += results_by_query.get((template.format(seed=seed), gl), [])
+
+    # Deduplicate all buckets (case-insensitive, first occurrence wins)
+    for buckets in expanded.values():
+        for key, suggestions in buckets.items():
+            seen = set()
+            unique = []
+            for s in suggestions:
+                k = s.lower()
+                if k not in seen and s.strip():
+                    seen.add(k)
+                    unique.append(s)
+            buckets[key] = unique[:RELATED_LIMIT if key == "Related Searches" else 100]  # Limit per category
+
+    return expanded, failed
 
 def generate_wordcloud(text_data: list[str]) -> str:
     """Generate word cloud from keywords"""
@@ -217,6 +326,43 @@ def generate_wordcloud(text_data: list[str]) -> str:
     img_str = base64.b64encode(img_buffer.getvalue()).decode()
     return img_str
 
+# Export serializers are cached so widget reruns reuse the encoded bytes; the cache
+# is shared by every session, so keep it small and short-lived
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    buf = pa.BufferOutputStream()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue().to_pybytes()
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    buf = pa.BufferOutputStream()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue().to_pybytes()
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def to_json_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_json(orient='records', indent=2).encode("utf-8")
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def to_xlsx_bytes(df: pd.DataFrame) -> bytes:
+    """Stream the results into a single-sheet workbook with autosized columns"""
+    # Imported here so the Excel stack only loads when an export is requested
+    import xlsxwriter
+
+    xlsx_io = io.BytesIO()
+    widths = df.astype(str).apply(lambda s: s.str.len().max()).to_dict()
+    with xlsxwriter.Workbook(xlsx_io, {"constant_memory": True, "strings_to_urls": False}) as wb:
+        # constant_memory flushes each row as soon as the next one starts, so
+        # widths are set up front and rows are written strictly in order
+        ws = wb.add_worksheet("Keywords")
+        for idx, col in enumerate(df.columns):
+            ws.set_column(idx, idx, max(widths[col], len(col)) + 2)
+        ws.write_row(0, 0, df.columns, wb.add_format({"bold": True}))
+        for row_idx, row in enumerate(df.itertuples(index=False), start=1):
+            ws.write_row(row_idx, 0, row)
+    return xlsx_io.getvalue()
+
 # ────────────────────────────
 ## 5. Enhanced Sidebar
 # ────────────────────────────
@@ -239,6 +385,8 @@ with st.sidebar:
         include_difficulty = st.checkbox("🎯 Include Difficulty Analysis", value=True)
         include_wordcloud = st.checkbox("☁️ Generate Word Cloud", value=True)
         max_suggestions = st.slider("Max suggestions per category", 20, 200, 100)
+        include_excel = st.checkbox("📗 Enable Excel Export", value=False,
+                                    help="Builds an .xlsx workbook alongside the other exports")
     
     st.markdown("---")
     
@@ -267,37 +415,30 @@ if go_btn:
         st.error("Please enter at least one seed keyword 🌱")
         st.stop()
 
-    # Progress tracking
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
     with st.spinner("🔄 Analyzing keywords and generating insights..."):
-        all_rows = []
-        tab_dfs = {
-            "Questions": [], "Prepositions": [], "Comparisons": [],
-            "Commercial Intent": [], "Temporal": [], "Related Searches": []
-        }
         gl_code = COUNTRY_TO_GL[country]
-        
-        total_seeds = len(seed_list)
-        
-        for i, seed in enumerate(seed_list):
-            status_text.text(f"Processing: {seed} ({i+1}/{total_seeds})")
-            progress_bar.progress((i + 1) / total_seeds)
-            
-            buckets = expand_keyword(seed, gl_code)
-            
-            for bucket_name, suggestions in buckets.items():
-                for s in suggestions[:max_suggestions]:
-                    row = {"Seed": seed, "Category": bucket_name, "Keyword": s, "Length": len(s.split())}
-                    all_rows.append(row)
-                    tab_dfs[bucket_name].append(row)
-            
-            time.sleep(0.1)  # Prevent rate limiting
 
-        master_df = pd.DataFrame(all_rows)
-        progress_bar.empty()
-        status_text.empty()
+        # Uncached queries for all seeds are fetched concurrently in a single event loop
+        expanded, failed = expand_seeds(seed_list, gl_code)
+        if failed:
+            st.warning(f"⚠️ {failed} Google requests failed, so results may be incomplete. "
+                       "Everything else was cached, so trying again only re-sends the failed queries.")
+
+        # Collect columns rather than row dicts and build the frame in one go
+        _seed, _category, _keyword = [], [], []
+        for seed in seed_list:
+            for bucket_name, suggestions in expanded[seed].items():
+                kept = suggestions[:max_suggestions]
+                _seed += [seed] * len(kept)
+                _category += [bucket_name] * len(kept)
+                _keyword += kept
+
+        # Explicit dtype so an empty run (nothing fetched) still supports .str below
+        master_df = pd.DataFrame({"Seed": _seed, "Category": _category, "Keyword": pd.Series(_keyword, dtype=object)})
+        master_df["Length"] = master_df["Keyword"].str.split().str.len()
+        # Seeds and categories come from tiny vocabularies, so store them as integer codes
+        master_df = master_df.astype({"Seed": "category", "Category": pd.CategoricalDtype(BUCKET_NAMES)})
+        tab_dfs = dict(tuple(master_df.groupby("Category", sort=False, observed=True)))
 
     # ── Analytics Dashboard
     if not master_df.empty:
@@ -352,6 +493,7 @@ if go_btn:
         # Category Distribution
         st.markdown("### 📈 Category Analysis")
         category_counts = master_df['Category'].value_counts()
+        category_counts = category_counts[category_counts > 0]
         
         col1, col2 = st.columns([2, 1])
         with col1:
@@ -381,7 +523,7 @@ if go_btn:
         # Filters
         filter_col1, filter_col2, filter_col3 = st.columns(3)
         with filter_col1:
-            seed_filter = st.multiselect("Filter by Seed", master_df['Seed'].unique())
+            seed_filter = st.multiselect("Filter by Seed", master_df['Seed'].unique().tolist())
         with filter_col2:
             length_filter = st.slider("Keyword Length", 1, int(master_df['Length'].max()), (1, int(master_df['Length'].max())))
         with filter_col3:
@@ -424,10 +566,10 @@ if go_btn:
             )
         
         # Individual category tabs
-        for i, (tab, category) in enumerate(zip(tabs[1:], tab_dfs.keys())):
+        for i, (tab, category) in enumerate(zip(tabs[1:], BUCKET_NAMES)):
             with tab:
-                if tab_dfs[category]:
-                    cat_df = pd.DataFrame(tab_dfs[category])
+                if category in tab_dfs:
+                    cat_df = tab_dfs[category]
                     display_cols = ['Keyword', 'Seed']
                     
                     if include_difficulty and 'analysis_df' in locals():
@@ -446,21 +588,20 @@ if go_btn:
                         st.dataframe(cat_df[display_cols], hide_index=True, height=400, use_container_width=True)
                     
                     # Category-specific insights
-                    st.info(f"💡 Found {len(tab_dfs[category])} {category.lower()} keywords")
+                    st.info(f"💡 Found {len(cat_df)} {category.lower()} keywords")
                 else:
                     st.info(f"No {category.lower()} keywords found for your seeds.")
 
         # ── Enhanced Export Options
         st.markdown("### ⬇️ Export Options")
         
-        export_col1, export_col2, export_col3 = st.columns(3)
+        export_col1, export_col2, export_col3, export_col4, export_col5 = st.columns(5)
+        export_df = analysis_df if 'analysis_df' in locals() else master_df
         
         with export_col1:
-            csv_data = analysis_df if 'analysis_df' in locals() else master_df
-            csv_bytes = csv_data.to_csv(index=False).encode("utf-8")
             st.download_button(
                 "📄 Download Full CSV",
-                csv_bytes,
+                to_csv_bytes(export_df),
                 f"keyword_research_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
                 "text/csv",
                 use_container_width=True,
@@ -468,11 +609,10 @@ if go_btn:
         
         with export_col2:
             # Top keywords only
-            top_keywords = master_df.groupby('Category').head(20)
-            top_csv = top_keywords.to_csv(index=False).encode("utf-8")
+            top_keywords = master_df.groupby('Category', observed=True).head(20)
             st.download_button(
                 "⭐ Download Top Keywords",
-                top_csv,
+                to_csv_bytes(top_keywords),
                 f"top_keywords_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
                 "text/csv",
                 use_container_width=True,
@@ -480,14 +620,37 @@ if go_btn:
         
         with export_col3:
             # JSON export for developers
-            json_data = master_df.to_json(orient='records', indent=2)
             st.download_button(
                 "🔧 Download JSON",
-                json_data.encode("utf-8"),
+                to_json_bytes(master_df),
                 f"keywords_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
                 "application/json",
                 use_container_width=True,
             )
+        
+        with export_col4:
+            # The workbook is only built (and xlsxwriter only imported) when opted in
+            if include_excel:
+                st.download_button(
+                    "📗 Download Excel",
+                    to_xlsx_bytes(export_df),
+                    f"keyword_research_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
+                )
+            else:
+                st.button("📗 Download Excel", disabled=True, use_container_width=True,
+                          help="Enable Excel export under ⚙️ Advanced Options")
+        
+        with export_col5:
+            # Columnar export, much smaller than CSV for the repetitive Seed/Category columns
+            st.download_button(
+                "📦 Download Parquet",
+                to_parquet_bytes(export_df),
+                f"keyword_research_{datetime.now().strftime('%Y%m%d_%H%M')}.parquet",
+                "application/vnd.apache.parquet",
+                use_container_width=True,
+            )
 
         # Research Summary
         st.markdown("### 📋 Research Summary")